@@ -6,14 +6,25 @@ import pandas as pd
 import seaborn as sns
 import warnings
 
+from collections import defaultdict
 from glob import glob
 from pandas.plotting import parallel_coordinates
 
-from polarization import Experiment
+from polarization import OPINION_DTYPE, Experiment
+
+
+# Result files are written once under a UUID name and never modified, so
+# final-polarization columns can be cached across plot calls.
+_FINAL_POLARIZATION_CACHE = {}
 
 
 def _all_final_polarizations(hdf, experiment='random any-range'):
-    return hdf[experiment + '/polarization'][:, -1]
+    key = (hdf.filename, experiment)
+    if key not in _FINAL_POLARIZATION_CACHE:
+        _FINAL_POLARIZATION_CACHE[key] = \
+            hdf[experiment + '/polarization'][:, -1]
+
+    return _FINAL_POLARIZATION_CACHE[key]
 
 
 def _final_mean(hdf, experiment='random any-range'):
@@ -28,6 +39,48 @@ def _hdf_list(data_dir):
     return [h5py.File(f, 'r') for f in glob(os.path.join(data_dir, '*'))]
 
 
+def _bucket_by_K(hdfs):
+    '''
+    Group open HDF handles by their K attribute so per-K plot loops index
+    a dict once instead of re-filtering the whole file list for every K.
+    '''
+    buckets = defaultdict(list)
+    for hdf in hdfs:
+        buckets[hdf.attrs['K']].append(hdf)
+    return buckets
+
+
+# Cache of attribute-index DataFrames keyed by data directory.
+_ATTRS_INDEX_CACHE = {}
+
+
+def _attrs_index(data_dir, refresh=False):
+    '''
+    Build, and cache per directory, a DataFrame indexing the HDF files in
+    data_dir by their root attributes. Each row holds one file's path plus
+    its attributes (K, S, noise_level, ...), so lookups by parameter no
+    longer open and introspect every file in the directory.
+
+    Arguments:
+        data_dir (str): directory containing HDF files from a modeling run
+        refresh (bool): rebuild the cached index, e.g. after new runs land
+
+    Returns:
+        (pd.DataFrame): one row per HDF file with a 'path' column
+    '''
+    if refresh or data_dir not in _ATTRS_INDEX_CACHE:
+        records = []
+        for f in glob(os.path.join(data_dir, '*')):
+            with h5py.File(f, 'r') as hdf:
+                record = dict(hdf.attrs)
+                record['path'] = f
+                records.append(record)
+
+        _ATTRS_INDEX_CACHE[data_dir] = pd.DataFrame(records)
+
+    return _ATTRS_INDEX_CACHE[data_dir]
+
+
 def _lookup_hdf(data_dir, **criteria):
     '''
     Assumes there is only one with the key, returns the first HDF file found
@@ -36,30 +89,27 @@ def _lookup_hdf(data_dir, **criteria):
     Arguments:
         data_dir (str): directory containing HDF files from a full modeling run
     '''
-    for f in glob(os.path.join(data_dir, '*')):
-
-        hdf = h5py.File(f, 'r')
-        match = True
-
-        for k, v in criteria.items():
-            try:
-                match &= hdf.attrs[k] == v
-            except KeyError:
-                warnings.warn('key {} not found for file {} in {}'.format(
-                    k, f, data_dir
-                ))
-                return None
-
-        if match:
-            return hdf
-        else:
-            hdf.close()
+    index = _attrs_index(data_dir)
+
+    match = np.ones(len(index), dtype=bool)
+    for k, v in criteria.items():
+        if k not in index.columns:
+            warnings.warn('key {} not found for files in {}'.format(
+                k, data_dir
+            ))
+            return None
+        match &= (index[k] == v).values
+
+    if not match.any():
+        return None
+
+    return h5py.File(index['path'][match].iloc[0], 'r')
 
 
 def plot_p_v_noise_and_k(data_dir, Ks=[2, 3, 4, 5], save_path=None,
                          pub=False, **kwargs):
 
-    hdfs = [h5py.File(f, 'r') for f in glob(os.path.join(data_dir, '*'))]
+    hdfs = _hdf_list(data_dir)
 
     if pub:
         fig, axes = plt.subplots(2, 2, figsize=(7, 9))
@@ -68,6 +118,8 @@ def plot_p_v_noise_and_k(data_dir, Ks=[2, 3, 4, 5], save_path=None,
         cbar_ax.set_title('Average polarization', loc='left')  # {'horizontalalignment': 'left'})
         # cbar_ax.set_yticklabels(['{:.1f}'.format(f) for f in np.arange(0.0, 1.2, 0.2)])
 
+    hdfs_by_K = _bucket_by_K(hdfs)
+
     for K_idx, K in enumerate(Ks):
 
         if 'figsize' in kwargs:
@@ -76,15 +128,12 @@ def plot_p_v_noise_and_k(data_dir, Ks=[2, 3, 4, 5], save_path=None,
             plt.figure()
 
         # Limit hdfs of interest to those of the K of current interest.
-        final_means = [
-            _final_mean(hdf) for hdf in hdfs
-            if hdf.attrs['K'] == K
-        ]
+        hdfs_K = hdfs_by_K[K]
+        final_means = [_final_mean(hdf) for hdf in hdfs_K]
 
         # Use noise_level and S as index to force uniqueness.
         index = [
-            (hdf.attrs['noise_level'], hdf.attrs['S']) for hdf in hdfs
-            if hdf.attrs['K'] == K
+            (hdf.attrs['noise_level'], hdf.attrs['S']) for hdf in hdfs_K
         ]
         index = pd.MultiIndex.from_tuples(index)
         index.set_names(['noise level', 'S'],
@@ -147,7 +196,7 @@ def plot_p_v_noise_and_k(data_dir, Ks=[2, 3, 4, 5], save_path=None,
 def average_distance_heatmap(data_dir, Ks=[2, 3, 4, 5], save_path=None,
                              pub=False, noise_lim=0.21, **kwargs):
 
-    hdfs = [h5py.File(f, 'r') for f in glob(os.path.join(data_dir, '*'))]
+    hdfs = _hdf_list(data_dir)
     hdfs = [hdf for hdf in hdfs if hdf.attrs['noise_level'] < noise_lim]
 
     if pub:
@@ -155,6 +204,8 @@ def average_distance_heatmap(data_dir, Ks=[2, 3, 4, 5], save_path=None,
         cbar_ax = fig.add_axes([1.05, 0.22, 0.05, 0.55])
         cbar_ax.set_title('Average distance from center')
 
+    hdfs_by_K = _bucket_by_K(hdfs)
+
     for K_idx, K in enumerate(Ks):
 
         if 'figsize' in kwargs:
@@ -165,15 +216,14 @@ def average_distance_heatmap(data_dir, Ks=[2, 3, 4, 5], save_path=None,
         # Limit hdfs of interest to those of the K of current interest.
         coord_addr = 'random any-range/final coords'
 
+        hdfs_K = hdfs_by_K[K]
         average_distances = [
-            _average_final_distance(hdf[coord_addr]) for hdf in hdfs
-            if hdf.attrs['K'] == K
+            _average_final_distance(hdf[coord_addr]) for hdf in hdfs_K
         ]
 
         # Use noise_level and S as index to force uniqueness.
         index = [
-            (hdf.attrs['noise_level'], hdf.attrs['S']) for hdf in hdfs
-            if hdf.attrs['K'] == K
+            (hdf.attrs['noise_level'], hdf.attrs['S']) for hdf in hdfs_K
         ]
         index = pd.MultiIndex.from_tuples(index)
         index.set_names(['noise level', 'S'],
@@ -275,9 +325,10 @@ def _nonzero_final_polarization_selector(hdf,
 
 def final_polarization_histogram(data_dir, **criteria):
 
-    polarizations = _all_final_polarizations(
-        _lookup_hdf(data_dir, **criteria)
-    )
+    hdf = _lookup_hdf(data_dir, **criteria)
+    polarizations = _all_final_polarizations(hdf)
+    hdf.close()
+
     plt.hist(polarizations)
 
 
@@ -311,20 +362,24 @@ def plot_S_K_experiment(data_dirs, plot_start=0, agg_fun=np.mean,
     # Build list of HDF files from data directories.
     hdfs = []
     for d in data_dirs:
-        hdfs += [h5py.File(f) for f in glob(os.path.join(d, '*.hdf5'))]
+        hdfs += [h5py.File(f, 'r') for f in glob(os.path.join(d, '*.hdf5'))]
 
     Ks = list(set(hdf.attrs['K'] for hdf in hdfs))
     Ks.sort()
 
+    # Discover the attribute schema once up front. Probing hdfs[0] inside
+    # the per-K loop assumed every file carried the same attributes.
+    has_noise_level = any('noise_level' in hdf.attrs for hdf in hdfs)
+
+    hdfs_by_K = _bucket_by_K(hdfs)
+
     n_hdfs_max = 0.0
     for K in Ks:
 
-        if 'noise_level' in hdfs[0].attrs:
-            hdfs_K = [hdf for hdf in hdfs
-                      if hdf.attrs['K'] == K
-                      and hdf.attrs['noise_level'] == 0.0]
-        else:
-            hdfs_K = [hdf for hdf in hdfs if hdf.attrs['K'] == K]
+        hdfs_K = hdfs_by_K[K]
+        if has_noise_level:
+            hdfs_K = [hdf for hdf in hdfs_K
+                      if hdf.attrs.get('noise_level', 0.0) == 0.0]
 
         hdfs_K.sort(key=lambda x: x.attrs['S'])
 
@@ -364,6 +419,9 @@ def plot_S_K_experiment(data_dirs, plot_start=0, agg_fun=np.mean,
     if save_path:
         plt.savefig(save_path)
 
+    for hdf in hdfs:
+        hdf.close()
+
 
 MPL_COLORS = plt.rcParams['axes.prop_cycle'].by_key()['color']
 
@@ -379,9 +437,11 @@ def plot_single_S_K(data_dir, K, save_path=None, semilogy=False, **kwargs):
     hdfs = _hdf_list(data_dir)
     hdfs_K = [hdf for hdf in hdfs if hdf.attrs['K'] == K]
     hdfs_K.sort(key=lambda x: x.attrs['S'])
-    hdf0 = hdfs_K[0]
+    # Load the final polarization column once per file; it is reused for
+    # both the per-trial scatter and the averages below.
+    final_polarizations = [_all_final_polarizations(hdf) for hdf in hdfs_K]
 
-    n_trials = len(_all_final_polarizations(hdf0))
+    n_trials = len(final_polarizations[0])
     S_vals = [hdf.attrs['S'] for hdf in hdfs_K]
 
     if semilogy:
@@ -398,17 +458,17 @@ def plot_single_S_K(data_dir, K, save_path=None, semilogy=False, **kwargs):
         color = 'black'
 
     # Plot all final pol values for every S value. One HDF for each S.
-    for idx, hdf in enumerate(hdfs_K):
+    for idx, finals in enumerate(final_polarizations):
         # Plot with a legend on the first S value.
         if idx == 0:
-            plot_fun([S_vals[idx]]*n_trials, _all_final_polarizations(hdf),
+            plot_fun([S_vals[idx]]*n_trials, finals,
                      's', color=color, ms=8, alpha=0.25,
                      label='Trial result', **kwargs)
         else:
-            plot_fun([S_vals[idx]]*n_trials, _all_final_polarizations(hdf),
+            plot_fun([S_vals[idx]]*n_trials, finals,
                      's', color=color, ms=8, alpha=0.25, **kwargs)
 
-    means = [_final_mean(hdf) for hdf in hdfs_K]
+    means = [np.nanmean(finals) for finals in final_polarizations]
 
     if 'lw' not in kwargs:
         kwargs['lw'] = 2
@@ -427,6 +487,9 @@ def plot_single_S_K(data_dir, K, save_path=None, semilogy=False, **kwargs):
     if save_path:
         plt.savefig(save_path)
 
+    for hdf in hdfs:
+        hdf.close()
+
 
 def plot_single_K_experiment(data_dir, experiment, x=[1, 2, 3, 5, 10],
                              save_path=None, semilogy=False, **kwargs):
@@ -465,8 +528,9 @@ def plot_single_K_experiment(data_dir, experiment, x=[1, 2, 3, 5, 10],
                      marker='s', ms=8, alpha=0.25, lw=0,
                      color=color)
 
-    means = [_final_mean(hdf, experiment=experiment)
-             for hdf in hdfs_lim]
+    # Reuse the batch-loaded final columns instead of slicing each
+    # dataset a second time.
+    means = [np.nanmean(finals) for finals in final_polarizations_cc]
 
     plt.plot(means, color=color, marker=None, label='Average', **kwargs)
 
@@ -482,6 +546,9 @@ def plot_single_K_experiment(data_dir, experiment, x=[1, 2, 3, 5, 10],
     if save_path:
         plt.savefig(save_path)
 
+    for hdf in hdfs:
+        hdf.close()
+
 
 def plot_figure12b(data_dir, stddev=True, full_ylim=True, x=None,
                    save_path=None,
@@ -567,6 +634,9 @@ def plot_figure12b(data_dir, stddev=True, full_ylim=True, x=None,
     if save_path:
         plt.savefig(save_path, bbox_inches='tight')
 
+    for hdf in hdf_dict.values():
+        hdf.close()
+
 
 class ExperimentRerun(Experiment):
 
@@ -600,13 +670,12 @@ class ExperimentRerun(Experiment):
                             distance_metric='fm2011')
 
         self.n_iter_sync = n_iter_sync
-        for idx, agent in enumerate(self.network.graph.nodes()):
-            agent.opinions = initial_opinions[idx]
-
-        self.history['coords'].append(
-            [n.opinions for n in self.network.graph.nodes()]
+        self.network.opinions = np.asarray(
+            initial_opinions, dtype=OPINION_DTYPE
         )
 
+        self.history['coords'].append(self.network.opinions.copy())
+
 
 def plot_single_noise_param(data_dir, K, save_path=None, **kwargs):
 
@@ -647,22 +716,26 @@ def plot_single_noise_param(data_dir, K, save_path=None, **kwargs):
     hdfs.sort(key=lambda x: x.attrs[x_key])
 
     x_vals = [hdf.attrs[x_key] for hdf in hdfs]
-    n_trials = len(_all_final_polarizations(hdfs[0]))
+
+    # Load the final polarization column once per file; it is reused for
+    # both the per-trial scatter and the averages below.
+    final_polarizations = [_all_final_polarizations(hdf) for hdf in hdfs]
+    n_trials = len(final_polarizations[0])
 
     # Still going to code data points by color according to K value.
     if K > 1:
         color = MPL_COLORS[K - 2]
 
-    for idx, hdf in enumerate(hdfs):
+    for idx, finals in enumerate(final_polarizations):
         if idx == 0:
-            plt.plot([x_vals[idx]]*n_trials, _all_final_polarizations(hdf),
+            plt.plot([x_vals[idx]]*n_trials, finals,
                      marker='s', color=color, ms=8, alpha=0.25, lw=0,
                      label='Trial result', **kwargs)
         else:
-            plt.plot([x_vals[idx]]*n_trials, _all_final_polarizations(hdf),
+            plt.plot([x_vals[idx]]*n_trials, finals,
                      marker='s', color=color, ms=8, alpha=0.25, lw=0, **kwargs)
 
-    means = [_final_mean(hdf) for hdf in hdfs]
+    means = [np.nanmean(finals) for finals in final_polarizations]
 
     if 'lw' not in kwargs:
         kwargs['lw'] = 2
@@ -766,6 +839,8 @@ def _plot_single_noise_example_K2(
 
     fig.subplots_adjust(top=1, bottom=0)
 
+    hdf.close()
+
     if save_path is not None:
         plt.savefig(save_path, bbox_inches='tight')
 
@@ -837,5 +912,7 @@ def _plot_single_noise_example_Kgt2(
     )
     axes[-1].tick_params(axis='x', which='major', labelsize=14)
 
+    hdf.close()
+
     if save_path is not None:
         plt.savefig(save_path, bbox_inches='tight')
@@ -1,6 +1,6 @@
 import numpy as np
 
-from polarization import Experiment
+from polarization import OPINION_DTYPE, RNG, Experiment
 
 
 class BoxedCavesExperiment(Experiment):
@@ -13,16 +13,12 @@ class BoxedCavesExperiment(Experiment):
                             distance_metric=distance_metric,
                             outcome_metric=outcome_metric)
 
-        _assign_boxed_constrained_opinions(
-            self.network.graph.nodes(), S, K
-        )
+        _assign_boxed_constrained_opinions(self.network, S, K)
 
-        self.history['coords'].append(
-            [n.opinions for n in self.network.graph.nodes()]
-        )
+        self.history['coords'].append(self.network.opinions.copy())
 
 
-def _assign_boxed_constrained_opinions(agents, S, K):
+def _assign_boxed_constrained_opinions(network, S, K):
     '''
     Arguments:
         S (float): value between 0 and 1 that limits absolute value of
@@ -31,5 +27,6 @@ def _assign_boxed_constrained_opinions(agents, S, K):
     Returns:
         None
     '''
-    for agent in agents:
-        agent.opinions = np.random.uniform(-S, S, size=(K,))
+    network.opinions = RNG.uniform(
+        -S, S, size=(network.n_nodes, K)
+    ).astype(OPINION_DTYPE)
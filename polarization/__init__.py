@@ -1,5 +1,5 @@
 from .polarization import (
-    Agent, raw_opinion_update_vec, opinion_update_vec,
+    OPINION_DTYPE, RNG, Agent, raw_opinion_update_vec, opinion_update_vec,
     polarization, Network, Experiment, calculate_weight,
-    get_opinions_xy
+    get_opinions_xy, seed_rng
 )
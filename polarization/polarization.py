@@ -5,109 +5,156 @@ Python implementation of Flache & Macy's "caveman" model of polarization.
 import itertools
 import numpy as np
 import networkx as nx
-import random
-import secrets
 
 from datetime import datetime
+from numba import njit
 from scipy.spatial.distance import cosine as cosine_distance
 # from sklearn.metrics.pairwise import cosine_similarity
-from scipy.spatial.distance import cdist
+from scipy.spatial.distance import pdist
+
+
+# Shared bit generator used for all sampling in the model.
+RNG = np.random.default_rng()
+
+
+def seed_rng(seed=None):
+    '''
+    Reseed the shared generator in place. Mutating the bit-generator state
+    rather than rebinding RNG keeps the reseed visible to modules that
+    imported RNG directly. Process pools must call this per trial: forked
+    workers inherit the parent's generator state, so unseeded pooled
+    trials would all draw the identical stream.
+
+    Arguments:
+        seed (int, SeedSequence or None): entropy for the new stream; None
+            draws fresh OS entropy.
+    '''
+    RNG.bit_generator.state = np.random.PCG64(seed).state
+    return RNG
+
+# Single precision is plenty for opinions confined to [-1, 1] and halves
+# the memory traffic of the sweep kernel and the persisted coordinates.
+OPINION_DTYPE = np.float32
 
 
 class Agent:
 
     def __init__(self, n_opinions=2, opinion_fill='random'):
 
-        self.opinions = np.random.uniform(low=-1.0, high=1.0, size=2)
+        self.opinions = RNG.uniform(low=-1.0, high=1.0, size=n_opinions)
         self.weights = {}
 
 
 class Network(nx.Graph):
 
-    def __init__(self, distance_metric='fm2011', initial_graph=None):
+    def __init__(self, distance_metric='fm2011', initial_graph=None,
+                 n_opinions=2):
         '''
         Create a network of any initial configuration. Provides methods
         for iterating (updating opinions and weights) and for randomizing
         connections. We can provide other helper functions or class methods
         for building specific initial configurations.
 
+        Opinions live in a single (n_nodes, n_opinions) matrix with one row
+        per agent; graph nodes are the integer row indices. This keeps the
+        iterate loop operating on contiguous arrays instead of chasing
+        per-agent attribute lookups.
         '''
-        self.graph = initial_graph
+        # Relabel nodes to consecutive integers so node id == row index
+        # into the opinion matrix.
+        self.graph = nx.convert_node_labels_to_integers(initial_graph)
         self.distance_metric = distance_metric
 
-        nodes = list(self.graph.nodes())
-        n_nodes = len(nodes)
-
+        n_nodes = self.graph.number_of_nodes()
         self.n_nodes = n_nodes
 
+        self.opinions = RNG.uniform(
+            low=-1.0, high=1.0, size=(n_nodes, n_opinions)
+        ).astype(OPINION_DTYPE)
+
+        self._refresh_neighbors()
+
+    def _refresh_neighbors(self, nodes=None):
+        '''
+        Rebuild the cached neighbor-index arrays used by iterate. Must be
+        called whenever edges change; pass the affected nodes to refresh
+        only those entries.
+        '''
+        if nodes is None:
+            self.neighbors_idx = [
+                np.fromiter(self.graph.neighbors(node), dtype=np.int32)
+                for node in range(self.n_nodes)
+            ]
+        else:
+            for node in nodes:
+                self.neighbors_idx[node] = np.fromiter(
+                    self.graph.neighbors(node), dtype=np.int32
+                )
+
+        # Cached degree of each node; consulted by the sweep kernel and
+        # also defines the CSR layout below.
+        self.degrees = np.fromiter(
+            (len(idx) for idx in self.neighbors_idx),
+            dtype=np.int32, count=self.n_nodes
+        )
+
+        # Flatten the adjacency to CSR (indptr/indices) int32 arrays so the
+        # compiled sweep kernel can walk it without touching Python objects.
+        self.neighbors_indptr = np.concatenate(
+            ([0], np.cumsum(self.degrees))
+        ).astype(np.int32)
+        self.neighbors_indices = np.concatenate(
+            self.neighbors_idx
+        ).astype(np.int32)
+
     def add_shortrange_random_edges(self, n_edges, n_caves):
         '''
         See p. 166 of FM2011
         '''
-        for _ in range(n_edges):
-            edge_added = False
-            while not edge_added:
-                # Select focal cave.
-                cave_idx = random.randint(0, n_caves - 1)
-                # Cave index "on the right."
-                next_cave_idx = cave_idx + 1 % n_caves - 1
-                # Select agent from focal cave.
-                focal_agents = [
-                    agent for agent in self.graph.nodes()
-                    if self.graph.node[agent]['cave_idx'] == cave_idx
-                ]
-                focal_agent = random.choice(focal_agents)
-                # Select agent from cave on the right.
-                next_cave_agents = [
-                    agent for agent in self.graph.nodes()
-                    if self.graph.node[agent]['cave_idx'] == next_cave_idx
-                ]
-                # import ipdb
-                # ipdb.set_trace()
-                new_neighbor_agent = random.choice(next_cave_agents)
-
-                # Check if the edge already exists in the graph.
+        # Group agents by cave once, instead of rescanning every node of
+        # the graph on each draw while edges are being added.
+        cave_members = [[] for _ in range(n_caves)]
+        for agent, data in self.graph.nodes(data=True):
+            cave_members[data['cave_idx']].append(agent)
+
+        n_added = 0
+        new_endpoints = set()
+        while n_added < n_edges:
+            # Draw focal caves for all still-needed edges in one batch.
+            cave_idxs = RNG.integers(n_caves, size=n_edges - n_added)
+
+            for cave_idx in cave_idxs:
+                # Select one agent from the focal cave and one from the
+                # cave "on the right."
+                focal_agent = int(RNG.choice(cave_members[cave_idx]))
+                new_neighbor_agent = int(RNG.choice(
+                    cave_members[(cave_idx + 1) % n_caves]
+                ))
+
+                # Only count the edge if it does not already exist.
                 if not self.graph.has_edge(focal_agent, new_neighbor_agent):
-                    # If not, add an edge between them.
                     self.graph.add_edge(focal_agent, new_neighbor_agent)
-                    edge_added = True
+                    new_endpoints.update((focal_agent, new_neighbor_agent))
+                    n_added += 1
 
-        # Update neighbors and weights.
-        for agent in self.graph.nodes():
-            neighbors = self.graph.neighbors(agent)
-            update_weights(agent, neighbors, self.distance_metric)
+        self._refresh_neighbors(new_endpoints)
 
     def add_random_edges(self, n_edges):
         '''
         FM2011 add 20 edges randomly and to immediate cave "to the right".
         This will add n_edges randomly.
         '''
-        # Create container for existing edges
-        # we find so we don't try them again.
-        existing_edges = set()
-
-        for i in range(n_edges):
-            have_new_edge = False
-            while not have_new_edge:
-                # Select a random pair of nodes from the graph.
-                node_pair = tuple(np.random.choice(
-                    self.graph.nodes(), 2, replace=False
-                ))
-                # Check if there is already an edge between the two nodes.
-                if node_pair in existing_edges:
-                    pass
-                elif self.graph.has_edge(*node_pair):
-                    existing_edges.add(node_pair)
-                # If not, create an edge between them.
-                else:
-                    self.graph.add_edge(*node_pair)
-                    existing_edges.add(node_pair)
-                    have_new_edge = True
-
-        # Update neighbors and weights.
-        for agent in self.graph.nodes():
-            neighbors = self.graph.neighbors(agent)
-            update_weights(agent, neighbors, self.distance_metric)
+        # Build the candidate non-edges once with set algebra instead of
+        # rejection-sampling random pairs against the graph.
+        all_pairs = set(itertools.combinations(range(self.n_nodes), 2))
+        existing_edges = {tuple(sorted(edge)) for edge in self.graph.edges()}
+        non_edges = sorted(all_pairs - existing_edges)
+
+        chosen = RNG.choice(len(non_edges), size=n_edges, replace=False)
+        new_edges = [non_edges[idx] for idx in chosen]
+
+        self.graph.add_edges_from(new_edges)
+        self._refresh_neighbors(set(itertools.chain.from_iterable(new_edges)))
 
     def rewire_edges(self, rewire_prob, percolation_limit=False):
         '''
@@ -117,9 +164,14 @@ class Network(nx.Graph):
         # Sample with replacement from this to keep self's edges pristine.
         edges_copy = list(self.graph.edges())
 
+        # Helper to sample two distinct edges from a list.
+        def sample_edge_pair(edges):
+            i1, i2 = RNG.choice(len(edges), size=2, replace=False)
+            return edges[i1], edges[i2]
+
         # Helper to get two edges to swap as explained in reference at top.
         def get_swap_edges(edges, target_edges):
-            e1, e2 = random.sample(edges, 2)
+            e1, e2 = sample_edge_pair(edges)
             A, B = e1
             C, D = e2
 
@@ -133,7 +185,7 @@ class Network(nx.Graph):
                     (B, D) in target_edges or (D, B) in target_edges
                 )
             while retry_condition(A, B, C, D):
-                e1, e2 = random.sample(edges, 2)
+                e1, e2 = sample_edge_pair(edges)
                 A, B = e1
                 C, D = e2
             return e1, e2
@@ -161,6 +213,8 @@ class Network(nx.Graph):
             edges_copy.remove(e1)
             edges_copy.remove(e2)
 
+        self._refresh_neighbors()
+
     # Actually this is doing 100 FM2011 iterations every time, one for each
     # agent.
     def iterate(self, noise_level=0.0):
@@ -172,21 +226,15 @@ class Network(nx.Graph):
         associated with each of its neighbors are updated but not both.
         '''
         # Select n_nodes with replacement to update.
-        node_list = list(self.graph.nodes())
-        update_nodes = np.random.choice(node_list, size=self.n_nodes)
-
-        for agent in update_nodes:
-            # Update either agent opinions or weights depending on flip.
-            flip = secrets.choice([False, True])
-            # TODO make neighbors an attribute of agent and make functions
-            # below into Agent methods.
-            neighbors = self.graph.neighbors(agent)
-
-            if flip:
-                agent.opinions = opinion_update_vec(agent, neighbors,
-                                                    noise_level=noise_level)
-            else:
-                update_weights(agent, neighbors, self.distance_metric)
+        update_nodes = RNG.integers(self.n_nodes, size=self.n_nodes)
+
+        # Draw the opinion-vs-weight coin flips and noise terms for every
+        # time step up front so the compiled sweep stays purely numeric.
+        flips = RNG.random(self.n_nodes) < 0.5
+        noise_terms = noise_level * RNG.standard_normal(self.n_nodes)
+
+        _sweep(self.opinions, self.neighbors_indptr, self.neighbors_indices,
+               self.degrees, update_nodes, flips, noise_terms)
 
     def draw(self):
         nx.draw_circular(self.graph)
@@ -203,11 +251,6 @@ class Experiment:
     '''
     def __init__(self, n_caves=20, n_per_cave=5, n_iter_sync=1000,
                  distance_metric='fm2011', outcome_metric='fm2011'):
-        # Initialize graph labelled by integers and randomize.
-        # network = Network(nx.connected_caveman_graph(n_caves, n_per_cave))
-        # Initialize an agent at each node.
-        # graph = nx.connected_caveman_graph(n_caves, n_per_cave)
-
         # Customizing the networkx source for building connected caveman.
         # See https://goo.gl/pFPxfZ.
         # Create caveman graph.
@@ -217,7 +260,7 @@ class Experiment:
             for cave_idx, start in enumerate(range(0, N, n_per_cave)):
 
                 for node_idx in range(start, start + n_per_cave):
-                    graph.node[node_idx]['cave_idx'] = cave_idx
+                    graph.nodes[node_idx]['cave_idx'] = cave_idx
 
                 edges = itertools.combinations(
                     range(start, start + n_per_cave), 2
@@ -228,17 +271,7 @@ class Experiment:
             graph.remove_edge(start, start + 1)
             graph.add_edge(start, (start - 1) % N)
 
-        relabelled_graph = nx.relabel_nodes(
-            graph,
-            {n: Agent() for n in graph.nodes()}
-        )
-
-        self.network = Network(distance_metric, relabelled_graph)
-
-        # XXX seems like something Network should handle.
-        for agent in self.network.graph.nodes():
-            neighbors = self.network.graph.neighbors(agent)
-            update_weights(agent, neighbors, self.network.distance_metric)
+        self.network = Network(distance_metric, graph)
 
         # History will store each timestep's polarization measure.
         self.history = {
@@ -273,44 +306,37 @@ class Experiment:
         for i in it:
 
             self.history['polarization'].append(
-                 polarization(self.network.graph, metric=self.outcome_metric)
+                 polarization(self.network.opinions,
+                              metric=self.outcome_metric)
             )
             self.network.iterate(noise_level=noise_level)
             self.iterations += 1
 
             if self.iterations % self.n_iter_sync == 0:
-                self.history['coords'].append(
-                    [n.opinions for n in self.network.graph.nodes()]
-                )
+                self.history['coords'].append(self.network.opinions.copy())
 
-        self.history['final coords'] = \
-            [n.opinions for n in self.network.graph.nodes()]
+        self.history['final coords'] = self.network.opinions.copy()
 
 
 def get_opinions_xy(opinions):
-    return np.array([o[0] for o in opinions]), np.array([o[1] for o in opinions])
+    opinions = np.asarray(opinions)
+    return opinions[:, 0], opinions[:, 1]
+
 
+def get_cave_opinions_xy(opinions, cave_idxs, n_caves=20):
 
-def get_cave_opinions_xy(agents, n_caves=20):
+    cave_idxs = np.asarray(cave_idxs)
 
     return {
-        i: get_opinions_xy(
-                [
-                    agent.opinions for agent in agents
-                    if agent.cave == i
-                ]
-            )
+        i: get_opinions_xy(opinions[cave_idxs == i])
         for i in range(n_caves)
     }
 
 
-def calculate_weight(a1, a2, nonnegative=False, distance_metric='fm2011'):
+def calculate_weight(o1, o2, nonnegative=False, distance_metric='fm2011'):
     '''
-    Calculate connection weight between two agents (Equation [1])
+    Calculate connection weight between two opinion vectors (Equation [1])
     '''
-    o1 = a1.opinions
-    o2 = a2.opinions
-
     if distance_metric == 'fm2011':
         if o1.shape != o2.shape:
             raise RuntimeError("Agent's opinion vectors have different shapes")
@@ -334,73 +360,116 @@ def calculate_weight(a1, a2, nonnegative=False, distance_metric='fm2011'):
         raise RuntimeError('Distance metric not recognized')
 
 
-def update_weights(agent, neighbors, distance_metric='fm2011'):
-    '''
-    Update agent weights in-place. TODO make this an Agent method.
-    '''
-    agent.weights = {
-        neighbor: calculate_weight(agent, neighbor,
-                                   distance_metric=distance_metric)
-        for neighbor in neighbors
-    }
-
-
-def raw_opinion_update_vec(agent, neighbors):
+def raw_opinion_update_vec(agent_idx, neighbor_idx, opinions):
     '''
     Equation ?? in Flache and Macy (2011).
     '''
-    neighbors = list(neighbors)
-    factor = (1.0 / (2.0 * len(neighbors)))
+    K = opinions.shape[1]
+    factor = (1.0 / (2.0 * len(neighbor_idx)))
 
-    return factor * np.sum(
-        agent.weights[neighbor] *
-        (neighbor.opinions - agent.opinions)
+    # Opinion differences with all neighbors at once, shape (degree, K).
+    d = opinions[neighbor_idx] - opinions[agent_idx]
+    # Weight with each neighbor (Equation 1).
+    w = 1.0 - (np.abs(d).sum(axis=1) / K)
 
-        for neighbor in neighbors
-    )
+    return factor * (w[:, None] * d).sum(axis=0)
 
 
-def opinion_update_vec(agent, neighbors, noise_level=0.0):
+def opinion_update_vec(agent_idx, neighbor_idx, opinions, noise_level=0.0):
 
-    raw_update_vec = raw_opinion_update_vec(agent, neighbors)
+    raw_update_vec = raw_opinion_update_vec(agent_idx, neighbor_idx, opinions)
 
-    ret = np.zeros(raw_update_vec.shape)
+    agent_opinions = opinions[agent_idx]
+    noise_term = noise_level * RNG.normal()
 
-    noise_term = noise_level * np.random.normal()
-    for i, op in enumerate(agent.opinions):
-        if op > 0:
-            ret[i] = op + ((noise_term + raw_update_vec[i])*(1 - op))
-        else:
-            ret[i] = op + ((noise_term + raw_update_vec[i])*(1 + op))
-
-    return ret
+    # Equation 2a scales the update by (1 - op) for positive opinions and
+    # (1 + op) otherwise, which is 1 - |op| in both cases.
+    return agent_opinions + (
+        (noise_term + raw_update_vec) * (1.0 - np.abs(agent_opinions))
+    )
 
 
-def polarization(graph, metric='fm2011'):
+@njit(cache=True, fastmath=True)
+def _sweep(opinions, indptr, indices, degrees, update_nodes, flips,
+           noise_terms):
+    '''
+    Compiled inner loop of Network.iterate: apply the opinion update of
+    Equations 1, 2, and 2a in-place for each selected agent whose coin flip
+    chose an opinion update. Neighbors are given in CSR form (indptr,
+    indices). Updates are sequential because the model is asynchronous:
+    each time step sees the opinions left by the previous one.
+    '''
+    K = opinions.shape[1]
+    inv_K = 1.0 / K
+
+    # Scratch buffers reused across time steps.
+    raw = np.zeros(K, dtype=opinions.dtype)
+    diff = np.empty(K, dtype=opinions.dtype)
+
+    for step in range(update_nodes.shape[0]):
+        if not flips[step]:
+            # Weight-update step: weights are derived from opinions,
+            # so there is nothing to do.
+            continue
+
+        i = update_nodes[step]
+        degree = degrees[i]
+        if degree == 0:
+            continue
+
+        start = indptr[i]
+        stop = start + degree
+
+        factor = 1.0 / (2.0 * degree)
+        noise_term = noise_terms[step]
+
+        for k in range(K):
+            raw[k] = 0.0
+        for jj in range(start, stop):
+            j = indices[jj]
+            abs_diff_sum = 0.0
+            for k in range(K):
+                diff[k] = opinions[j, k] - opinions[i, k]
+                abs_diff_sum += abs(diff[k])
+            w = 1.0 - (abs_diff_sum * inv_K)
+            for k in range(K):
+                raw[k] += w * diff[k]
+
+        for k in range(K):
+            op = opinions[i, k]
+            update = noise_term + (factor * raw[k])
+            # Equation 2a's sign-dependent scaling, branchless.
+            opinions[i, k] = op + (update * (1.0 - abs(op)))
+
+
+def polarization(opinions, metric='fm2011'):
     '''
     Implementing Equation 3. Metrics used: fm2011, cityblock, or euclidian.
     fm2011 uses cityblock scaled by 1/K.
 
+    Arguments:
+        opinions (np.ndarray): (n_agents, K) matrix of opinion coordinates.
+
     Returns:
         (float) : variance of all pairwise distances.
     '''
-    # List of opinion coordinates for all agents.
-    X = [n.opinions for n in graph.nodes()]
-    # To be used in slicing out the upper triangle of the distance matrix.
-    N = len(X)
+    X = np.asarray(opinions)
 
     if metric == 'fm2011':
         # FM2011 distance metric contains an averaging factor over features.
-        K = len(X[0])
+        K = X.shape[1]
         # The FM2011 distance is just cityblock/manhattan/L1 distance
         # scaled by 1/K.
-        distances = (1.0 / K) * cdist(X, X, metric='cityblock')
+        distances = (1.0 / K) * pdist(X, metric='cityblock')
     else:
-        distances = cdist(X, X, metric=metric)
+        distances = pdist(X, metric=metric)
 
     # FM2011 use the variance over non-repeating d_ij with i≠j, as
     # best I can tell. Their explanation/notation is confusing, see p. 156.
-    # I believe by taking either the upper or lower triangle of the distance
-    # matrix implements the summation; the triangles are equivalent. k=1
-    # drops the diagonal.
-    return distances[np.triu_indices(N, k=1)].var()
+    # The condensed form pdist returns holds each unordered pair exactly
+    # once, which implements the summation directly without building the
+    # N x N matrix and slicing out a triangle. The sum of squared
+    # deviations contracts in a single einsum pass, skipping the squared
+    # temporary .var() would allocate.
+    deviations = distances - distances.mean()
+    return np.einsum('i,i->', deviations, deviations) / distances.size
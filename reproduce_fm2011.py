@@ -112,8 +112,11 @@ def persist_experiments(experiments, hdf_filename=None, append_datetime=False,
 
             # Each list in the experiments dictionary is considered a
             # single trial for the particular experimental condition.
+            # Materialize first: the runner passes pool.imap iterators,
+            # which are one-shot and would be exhausted by the first
+            # comprehension below.
             if experiment_name in experiments:
-                trials = experiments[experiment_name]
+                trials = list(experiments[experiment_name])
 
                 # Take "y" vector from each polarization history, which is
                 # polarization itself. XXX For some reason I am logging
@@ -134,10 +137,15 @@ def persist_experiments(experiments, hdf_filename=None, append_datetime=False,
                     [trial['graph'] for trial in trials]
                 )
 
+                n_trials, n_iterations = polarizations.shape
+
                 hf.create_dataset(
                     experiment_name + '/polarization',
                     data=polarizations,
-                    compression='gzip'
+                    compression='gzip',
+                    # Chunk across all trials so the common [:, -1]
+                    # final-polarization read touches a single chunk.
+                    chunks=(n_trials, min(n_iterations, 256))
                 )
                 hf.create_dataset(
                     experiment_name + '/final coords',
@@ -147,7 +155,10 @@ def persist_experiments(experiments, hdf_filename=None, append_datetime=False,
                 hf.create_dataset(
                     experiment_name + '/coords',
                     data=coords,
-                    compression='gzip'
+                    compression='gzip',
+                    # One trial's snapshot per chunk, matching the
+                    # [trial, snapshot] reads in the plotting code.
+                    chunks=(1, 1) + coords.shape[2:]
                 )
                 hf.create_dataset(
                     experiment_name + '/graph',
@@ -1,4 +1,5 @@
 import click
+import itertools
 import multiprocessing as mp
 import networkx as nx
 import numpy as np
@@ -9,13 +10,19 @@ from urllib.parse import parse_qs
 from uuid import uuid4
 
 from experiments.within_box import BoxedCavesExperiment
+from polarization import seed_rng
 from reproduce_fm2011 import persist_experiments
 from complexity_analysis import _lookup_hdf, ExperimentRerun
 
 
-def _run_exp(_, experiment='connected caveman', noise_level=0.0,
+def _run_exp(trial_idx, experiment='connected caveman', noise_level=0.0,
              n_caves=20, n_per_cave=5, S=1.0, K=2, n_iterations=4000,
-             n_iter_sync=1000, distance_metric='fm2011', verbose=False):
+             n_iter_sync=1000, distance_metric='fm2011', verbose=False,
+             seed=None):
+
+    # Forked pool workers inherit the parent's RNG state, so every trial
+    # reseeds the shared generator with its own child of the run's seed.
+    seed_rng(np.random.SeedSequence(entropy=seed, spawn_key=(trial_idx,)))
 
     # Add the same number random short-range or long-range ties.
     n_edges = 20
@@ -58,7 +65,7 @@ def _run_exp(_, experiment='connected caveman', noise_level=0.0,
         'polarization': ret.history['polarization'],
         'final coords': ret.history['final coords'],
         'coords': [list(c) for c in ret.history['coords']],
-        'graph': nx.to_numpy_matrix(ret.network.graph)
+        'graph': nx.to_numpy_array(ret.network.graph)
     }
 
 
@@ -75,25 +82,32 @@ def cli(ctx):
 @click.option('--n_iter_sync', default=200)
 @click.option('--distance_metric', default='fm2011')
 @click.pass_context
-def reproduce_fig12(ctx, k, output_dir, n_trials, n_iterations, distance_metric):
+def reproduce_fig12(ctx, k, output_dir, n_trials, n_iterations, n_iter_sync,
+                    distance_metric):
     '''
     Create a set of HDF files corresponding to datasets for reproducing Figure 12b in FM2011
     '''
     # Set some processors aside for Numpy computations.
     pool = _get_default_pool()
 
+    # One base seed per condition; each trial derives its own substream.
+    seeds = _condition_seeds()
+
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='connected caveman', K=k, distance_metric=distance_metric)
+                   experiment='connected caveman', K=k, distance_metric=distance_metric,
+                   n_iter_sync=n_iter_sync, seed=seeds['connected caveman'])
     cc_experiments = pool.imap(func, range(n_trials))
     print('completed connected caveman')
 
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='random short-range', K=k, distance_metric=distance_metric)
+                   experiment='random short-range', K=k, distance_metric=distance_metric,
+                   n_iter_sync=n_iter_sync, seed=seeds['random short-range'])
     srt_experiments = pool.imap(func, range(n_trials))
     print('completed short-range')
 
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='random any-range', K=k, distance_metric=distance_metric)
+                   experiment='random any-range', K=k, distance_metric=distance_metric,
+                   n_iter_sync=n_iter_sync, seed=seeds['random any-range'])
     any_experiments = pool.imap(func, range(n_trials))
     print('completed any-range')
 
@@ -108,7 +122,8 @@ def reproduce_fig12(ctx, k, output_dir, n_trials, n_iterations, distance_metric)
     persist_experiments(
         experiments,
         hdf_filename=output_path,
-        metadata={'K': k, 'distance metric': distance_metric}
+        metadata={'K': k, 'distance metric': distance_metric,
+                  **_seed_metadata(seeds)}
     )
 
 
@@ -126,18 +141,24 @@ def reproduce_fig11(ctx, n_per_cave, output_dir, n_trials, n_iterations):
 
     pool = mp.Pool(mp.cpu_count())
 
+    # One base seed per condition; each trial derives its own substream.
+    seeds = _condition_seeds()
+
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='connected caveman', n_per_cave=n_per_cave)
+                   experiment='connected caveman', n_per_cave=n_per_cave,
+                   seed=seeds['connected caveman'])
     cc_experiments = pool.imap(func, range(n_trials))
     print('completed connected caveman')
 
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='random short-range', n_per_cave=n_per_cave)
+                   experiment='random short-range', n_per_cave=n_per_cave,
+                   seed=seeds['random short-range'])
     srt_experiments = pool.imap(func, range(n_trials))
     print('completed short-range')
 
     func = partial(_run_exp, n_iterations=n_iterations,
-                   experiment='random any-range', n_per_cave=n_per_cave)
+                   experiment='random any-range', n_per_cave=n_per_cave,
+                   seed=seeds['random any-range'])
     any_experiments = pool.imap(func, range(n_trials))
     print('completed any-range')
 
@@ -152,7 +173,8 @@ def reproduce_fig11(ctx, n_per_cave, output_dir, n_trials, n_iterations):
     persist_experiments(
         experiments,
         hdf_filename=output_path,
-        metadata={'K': 2, 'n_per_cave': n_per_cave}
+        metadata={'K': 2, 'n_per_cave': n_per_cave,
+                  **_seed_metadata(seeds)}
     )
 
 
@@ -163,6 +185,23 @@ def _get_default_pool(max_=True):
         return mp.Pool(max(2, mp.cpu_count() - 4))
 
 
+def _condition_seeds(conditions=('connected caveman', 'random short-range',
+                                 'random any-range')):
+    '''
+    Draw one base seed per experimental condition; each trial spawns its
+    own SeedSequence child from it in _run_exp.
+    '''
+    return {name: np.random.SeedSequence().entropy for name in conditions}
+
+
+def _seed_metadata(seeds):
+    '''
+    Base seeds are 128-bit ints, too wide for HDF integer attributes, so
+    record them as strings.
+    '''
+    return {'seed ' + name: str(seed) for name, seed in seeds.items()}
+
+
 @cli.command()
 @click.argument('s', type=float)
 @click.argument('k', type=int)
@@ -181,10 +220,12 @@ def complexity_experiment(ctx, s, k, noise_level, output_dir, distance_metric,
 
     pool = _get_default_pool()
 
+    seed = np.random.SeedSequence().entropy
+
     func = partial(_run_exp, n_iterations=n_iterations,
                    noise_level=noise_level, experiment='random any-range',
                    K=k, S=s, distance_metric=distance_metric,
-                   n_iter_sync=n_iter_sync)
+                   n_iter_sync=n_iter_sync, seed=seed)
 
     experiments = {
         # 'random any-range': pool.imap(func, range(n_trials))
@@ -198,21 +239,87 @@ def complexity_experiment(ctx, s, k, noise_level, output_dir, distance_metric,
         metadata={
             'K': k, 'S': s, 'noise_level': noise_level,
             'distance_metric': distance_metric,
-            'n_iter_sync': n_iter_sync
+            'n_iter_sync': n_iter_sync,
+            'seed': str(seed)
         }
     )
 
 
+@cli.command()
+@click.argument('s_vals')
+@click.argument('k_vals')
+@click.argument('noise_levels')
+@click.argument('output_dir', type=str)
+@click.option('--distance_metric', default='fm2011')
+@click.option('--n_trials', default=5)
+@click.option('--n_iterations', default=4000)
+@click.option('--n_iter_sync', default=200)
+@click.pass_context
+def complexity_sweep(ctx, s_vals, k_vals, noise_levels, output_dir,
+                     distance_metric, n_trials, n_iterations, n_iter_sync):
+    '''
+    Run the full (S, K, noise_level) grid over one process pool. Values are
+    comma-separated, e.g. polexp complexity_sweep 0.5,1.0 2,3 0.0,0.1 data/
+    '''
+    S_list = [float(s) for s in s_vals.split(',')]
+    K_list = [int(k) for k in k_vals.split(',')]
+    noise_list = [float(n) for n in noise_levels.split(',')]
+
+    pool = _get_default_pool()
+
+    # Submit every trial of every (K, S, noise_level) combination to the
+    # shared pool up front, so independent parameter combinations run
+    # concurrently instead of one pool-wide barrier per combination. Each
+    # combination gets its own base seed; trials derive substreams from it.
+    async_results = []
+    for K, S, noise_level in itertools.product(K_list, S_list, noise_list):
+
+        seed = np.random.SeedSequence().entropy
+
+        func = partial(_run_exp, n_iterations=n_iterations,
+                       noise_level=noise_level, experiment='random any-range',
+                       K=K, S=S, distance_metric=distance_metric,
+                       n_iter_sync=n_iter_sync, seed=seed)
+
+        async_results.append(
+            ((K, S, noise_level, seed),
+             pool.map_async(func, range(n_trials)))
+        )
+
+    pool.close()
+
+    for (K, S, noise_level, seed), result in async_results:
+
+        experiments = {'random any-range': result.get()}
+
+        output_path = os.path.join(output_dir, _uuid_hdfname())
+
+        persist_experiments(
+            experiments, hdf_filename=output_path,
+            metadata={
+                'K': K, 'S': S, 'noise_level': noise_level,
+                'distance_metric': distance_metric,
+                'n_iter_sync': n_iter_sync,
+                'seed': str(seed)
+            }
+        )
+
+    pool.join()
+
+
 def _uuid_hdfname():
     return str(uuid4()) + '.hdf5'
 
 
-def _rerun_exp(_, initial_opinions=None,
+def _rerun_exp(trial_idx, initial_opinions=None,
                n_iterations=4000, n_iter_sync=1000,
-               experiment='connected caveman', verbose=False):
+               experiment='connected caveman', verbose=False, seed=None):
     if experiment != 'connected caveman':
         raise RuntimeError('{} not yet implemented.'.format(experiment))
 
+    # Per-trial reseed, as in _run_exp.
+    seed_rng(np.random.SeedSequence(entropy=seed, spawn_key=(trial_idx,)))
+
     cc = ExperimentRerun(initial_opinions, experiment=experiment,
                          n_iter_sync=n_iter_sync)
 
@@ -224,7 +331,7 @@ def _rerun_exp(_, initial_opinions=None,
         'polarization': ret.history['polarization'],
         'final coords': ret.history['final coords'],
         'coords': [list(c) for c in ret.history['coords']],
-        'graph': nx.to_numpy_matrix(ret.network.graph)
+        'graph': nx.to_numpy_array(ret.network.graph)
     }
 
 
@@ -259,8 +366,10 @@ def rerun_experiment(ctx, data_dir, spec_str, output_filename,
 
     initial_opinions = data['coords'][trial_index, 0]
 
+    seed = np.random.SeedSequence().entropy
+
     func = partial(_rerun_exp, n_iterations=n_iterations,
-                   initial_opinions=initial_opinions)
+                   initial_opinions=initial_opinions, seed=seed)
 
     pool = _get_default_pool()
 
@@ -275,4 +384,4 @@ def rerun_experiment(ctx, data_dir, spec_str, output_filename,
     # }
 
     persist_experiments(experiments, hdf_filename=output_filename,
-                        metadata=hdf.attrs)
+                        metadata={**dict(hdf.attrs), 'seed': str(seed)})
@@ -12,8 +12,9 @@ install_requires = [
     'joblib==0.11',
     'kiwisolver==1.0.1',
     'matplotlib==2.2.0',
-    'networkx==1.11',
-    'numpy>=1.13.1',
+    'networkx>=2',
+    'numba>=0.45',
+    'numpy>=1.17',
     'packaging==16.8',
     'pandas==0.22.0',
     'parso==0.1.1',
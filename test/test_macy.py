@@ -3,32 +3,29 @@ import numpy as np
 import unittest
 
 from polarization import (
-    Agent, calculate_weight,
+    Network, calculate_weight,
     raw_opinion_update_vec, opinion_update_vec, polarization
 )
+from polarization.polarization import _sweep
 
 
 class TestBasicCalculations(unittest.TestCase):
 
     def setUp(self):
 
-        self.a1_2 = Agent()
-        self.a2_2 = Agent()
-        self.a3_2 = Agent()
-        self.a4_2 = Agent()
-
-        self.a1_2.opinions = np.array([-1.0, 0.5])
-        self.a2_2.opinions = np.array([-.5, .2])
-        self.a3_2.opinions = np.array([-.7, .6])
-        self.a4_2.opinions = np.array([-.7, .4])
-
-        self.a1_3 = Agent()
-        self.a2_3 = Agent()
-        self.a3_3 = Agent()
-        self.a4_3 = Agent()
+        # Four agents with K=2 opinions, one row per agent.
+        self.opinions_2 = np.array([
+            [-1.0, 0.5],
+            [-.5, .2],
+            [-.7, .6],
+            [-.7, .4]
+        ])
 
-        self.a1_3.opinions = np.array([-1.0, 0.5, -.7])
-        self.a2_3.opinions = np.array([-.5, .2, .8])
+        # Two agents with K=3 opinions.
+        self.opinions_3 = np.array([
+            [-1.0, 0.5, -.7],
+            [-.5, .2, .8]
+        ])
 
     def test_calculate_weight(self):
         '''
@@ -37,11 +34,15 @@ class TestBasicCalculations(unittest.TestCase):
 
         num = 0.5 + 0.3
         expected = 1 - (num/2.0)
-        assert calculate_weight(self.a1_2, self.a2_2) == expected
+        assert calculate_weight(
+            self.opinions_2[0], self.opinions_2[1]
+        ) == expected
 
         num = 0.5 + 0.3 + 1.5
         expected = 1 - (num/3.0)
-        assert calculate_weight(self.a1_3, self.a2_3) == expected
+        assert calculate_weight(
+            self.opinions_3[0], self.opinions_3[1]
+        ) == expected
 
     def test_raw_state_update(self):
         '''
@@ -49,13 +50,9 @@ class TestBasicCalculations(unittest.TestCase):
         '''
 
         num_neighbors_fac = 1.0 / (2.0 * 3)
-        w_12 = calculate_weight(self.a1_2, self.a2_2)
-        w_13 = calculate_weight(self.a1_2, self.a3_2)
-        w_14 = calculate_weight(self.a1_2, self.a4_2)
-
-        self.a1_2.weights[self.a2_2] = w_12
-        self.a1_2.weights[self.a3_2] = w_13
-        self.a1_2.weights[self.a4_2] = w_14
+        w_12 = calculate_weight(self.opinions_2[0], self.opinions_2[1])
+        w_13 = calculate_weight(self.opinions_2[0], self.opinions_2[2])
+        w_14 = calculate_weight(self.opinions_2[0], self.opinions_2[3])
 
         S = (w_12*np.array([.5, -.3])) + \
             (w_13*np.array([.3, .1])) + \
@@ -63,9 +60,14 @@ class TestBasicCalculations(unittest.TestCase):
 
         expected = num_neighbors_fac * S
         calculated = raw_opinion_update_vec(
-            self.a1_2, [self.a2_2, self.a3_2, self.a4_2]
+            0, np.array([1, 2, 3]), self.opinions_2
         )
 
+        # Regression guard: the old generator-based reduction collapsed
+        # to a 0-d object array instead of a K-vector.
+        assert calculated.shape == (2,)
+        assert calculated.dtype == np.float64
+
         assert (calculated == expected).all(), 'calc: {}\nexpec: {}'.format(
             calculated, expected
         )
@@ -74,37 +76,53 @@ class TestBasicCalculations(unittest.TestCase):
         '''
         Correct calc of opinion update according to F&M (2011) Equation 2a
         '''
-        neighbors = [self.a2_2, self.a3_2, self.a4_2]
-
-        w_12 = calculate_weight(self.a1_2, self.a2_2)
-        w_13 = calculate_weight(self.a1_2, self.a3_2)
-        w_14 = calculate_weight(self.a1_2, self.a4_2)
+        neighbor_idx = np.array([1, 2, 3])
 
-        self.a1_2.weights[self.a2_2] = w_12
-        self.a1_2.weights[self.a3_2] = w_13
-        self.a1_2.weights[self.a4_2] = w_14
-
-        raw_update_vec = raw_opinion_update_vec(self.a1_2, neighbors)
+        raw_update_vec = raw_opinion_update_vec(
+            0, neighbor_idx, self.opinions_2
+        )
 
         expected_0 = \
-            self.a1_2.opinions[0] + \
-            ((1 + self.a1_2.opinions[0]) * raw_update_vec[0])
+            self.opinions_2[0, 0] + \
+            ((1 + self.opinions_2[0, 0]) * raw_update_vec[0])
 
         expected_1 = \
-            self.a1_2.opinions[1] + \
-            ((1 - self.a1_2.opinions[1]) * raw_update_vec[1])
+            self.opinions_2[0, 1] + \
+            ((1 - self.opinions_2[0, 1]) * raw_update_vec[1])
 
         calculated = opinion_update_vec(
-            self.a1_2, neighbors
+            0, neighbor_idx, self.opinions_2
         )
         expected = np.array([expected_0, expected_1])
 
         assert (calculated == expected).all(), \
             'calculated: {}\nexpected: {}'.format(calculated, expected)
 
+    def test_sweep_kernel(self):
+        '''
+        Compiled sweep kernel reproduces the reference update functions.
+        '''
+        net = Network(initial_graph=nx.complete_graph(4))
+        net.opinions = self.opinions_2.copy()
+
+        # Apply the reference update sequentially, as the async model does.
+        update_nodes = np.array([0, 2, 1, 3, 2])
+        expected = net.opinions.copy()
+        for i in update_nodes:
+            expected[i] = opinion_update_vec(
+                i, net.neighbors_idx[i], expected
+            )
+
+        _sweep(net.opinions, net.neighbors_indptr, net.neighbors_indices,
+               net.degrees, update_nodes,
+               np.ones(len(update_nodes), dtype=np.bool_),
+               np.zeros(len(update_nodes)))
+
+        np.testing.assert_allclose(net.opinions, expected, rtol=1e-12)
+
     def test_polarization(self):
         '''
-        Polarization on graph equals expected manual calculation.
+        Polarization on opinion matrix equals expected manual calculation.
         '''
 
         d = np.zeros((4, 4))
@@ -122,18 +140,7 @@ class TestBasicCalculations(unittest.TestCase):
 
         expected = np.sum((d_sub_mean)**2) / (4 * 3)
 
-        g = nx.Graph()
-        a1 = self.a1_2
-        a2 = self.a2_2
-        a3 = self.a3_2
-        a4 = self.a4_2
-
-        g.add_edges_from([
-            (e1, e2, {'weight': calculate_weight(e1, e2)})
-            for e1, e2 in [(a1, a2), (a1, a4), (a2, a3), (a3, a4)]
-        ])
-
-        calculated = polarization(g)
+        calculated = polarization(self.opinions_2)
 
         np.testing.assert_approx_equal(
             expected, calculated,
@@ -49,7 +49,7 @@ def vis_graph(n_caves, n_per_cave, l=2, lp=0.2, cave_adjust_angle=1.625*np.pi,
         n_agents = n_caves * n_per_cave
         node_colors = [colors[ii // n_per_cave] for ii in range(n_agents)]
     else:
-        node_colors = [colors[gr.node[node]['cave_idx']]
+        node_colors = [colors[gr.nodes[node]['cave_idx']]
                        for node in pos_dict.keys()]
 
     plt.figure(figsize=figsize)